@@ -0,0 +1,30 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+# Anchored to this file rather than the working directory so the server and
+# the client's local read path find the same database; MCP_SQLITE_DB overrides.
+DB_PATH = Path(os.getenv("MCP_SQLITE_DB", Path(__file__).parent / "demo.db")).resolve()
+FETCH_SIZE = 256
+MAX_ROWS = 1000
+
+_READERS = threading.local()
+
+def reader():
+    """Per-thread read-only connection to DB_PATH; never creates the database."""
+    conn = getattr(_READERS, 'conn', None)
+    if conn is None:
+        conn = _READERS.conn = sqlite3.connect(f"{DB_PATH.as_uri()}?mode=ro", uri=True)
+    return conn
+
+def fetch(cursor, max_rows):
+    """Drain a cursor into a read_data payload, reading at most max_rows + 1 rows."""
+    columns = [column[0] for column in cursor.description or ()]
+    rows = []
+    # Pull pages instead of fetchall() so a huge table never gets
+    # materialised past max_rows; one extra row tells us it was cut.
+    while len(rows) <= max_rows and (batch := cursor.fetchmany(min(FETCH_SIZE, max_rows + 1 - len(rows)))):
+        rows.extend(batch)
+    cursor.close()
+    return {"columns": columns, "rows": rows[:max_rows], "truncated": len(rows) > max_rows}
@@ -1,15 +1,34 @@
 import asyncio
-import nest_asyncio
-from langchain_ollama import ChatOllama
+import json
+import os
+import re
+import sqlite3
+from contextlib import aclosing
+from functools import partial
+import numpy as np
+from langchain_ollama import ChatOllama, OllamaEmbeddings
 from langchain_mcp_adapters.client import MultiServerMCPClient
-from langchain.agents import AgentExecutor, create_react_agent
+from langchain.agents import AgentExecutor
+from langchain.agents.format_scratchpad import format_log_to_str
+from langchain.agents.output_parsers import ReActSingleInputOutputParser
 from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, get_buffer_string
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from langchain_core.tools import render_text_description
 from langchain.tools import Tool
 import httpx
+from database import DB_PATH, MAX_ROWS, fetch, reader
 
-nest_asyncio.apply()
+# nest_asyncio swaps in the pure-Python event loop; only patch when a
+# re-entrant loop is actually needed (e.g. running inside a notebook).
+if os.getenv("MCP_NEST_ASYNCIO"):
+    import nest_asyncio
+    nest_asyncio.apply()
 
+# Ollama reuses the KV cache for the longest prompt prefix it has already
+# seen, so everything above "For example:" must stay byte-identical between
+# turns. The retrieved {example} only changes with the kind of question; keep
+# per-turn values ({input}, {agent_scratchpad}, history) at the very end.
 REACT_TEMPLATE = """Answer the following questions as best you can. You have access to the following tools:
 
 {tools}
@@ -25,38 +44,236 @@ Thought: I now know the final answer
 Final Answer: A summary of the result
 
 For example:
-Question: add John Doe 30 year old Engineer
+{example}
+
+Begin!
+
+{chat_history}Question: {input}
+{agent_scratchpad}"""
+
+# Once more than twice this many messages are unsummarized, all but the last
+# HISTORY_WINDOW are folded into a running summary. Keep it even so each
+# question stays with its answer.
+HISTORY_WINDOW = 8
+
+# Few-shot exemplars; only the one closest to the question goes into the prompt.
+EXAMPLES = [
+    """Question: add John Doe 30 year old Engineer
 Thought: I need to add a new person to the database
 Action: add_data
 Action Input: INSERT INTO people (name, age, profession) VALUES ('John Doe', 30, 'Engineer')
 Observation: Data added successfully
 Thought: I have successfully added the person
-Final Answer: Added John Doe to people
-
-Question: create a car table
+Final Answer: Added John Doe to people""",
+    """Question: create a car table
 Thought: I need to create a new table called car
 Action: create_table
 Action Input: CREATE TABLE IF NOT EXISTS car (id INTEGER PRIMARY KEY, make TEXT, year INTEGER)
 Observation: Table created
 Thought: Table was created successfully
-Final Answer: car table created
-
-Question: show all car records
+Final Answer: car table created""",
+    """Question: show all car records
 Thought: I need to retrieve all records from the car table
 Action: read_data
 Action Input: SELECT * FROM car
 Observation: [Formatted table with records]
 Thought: I have retrieved all records
-Final Answer: [Formatted car table]
+Final Answer: [Formatted car table]"""
+]
 
-Begin!
+SYSTEM_PROMPT = """You are an AI assistant that helps users interact with a database.
+You can add, read from, and create tables in the database using the available tools.
+Always think before acting. Ensure the SQL is correct.
 
-Question: {input}
-{agent_scratchpad}"""
+        When adding data:
+        1. Format the SQL query correctly
+        2. Make sure to use single quotes around text values
+        3. Don't use quotes around numeric values
+        
+        When reading data:
+        1. Use WHERE clause for filtering
+        2. Present results in a clear, formatted way
+        
+        Always:
+        1. Think through each step carefully
+        2. Verify actions were successful
+        3. Provide clear summaries of what was done"""
+
+# Questions that may change the database must never be answered from cache.
+WRITE_INTENT = re.compile(
+    r"\b(add|insert|create|update|delete|remove|drop|alter|change|rename|set)\b",
+    re.IGNORECASE
+)
+
+# Follow-ups like "show them again" depend on the conversation, not just the text.
+REFERS_BACK = re.compile(
+    r"\b(it|its|they|them|their|those|these|that|this|he|she|him|her|again|same|above|"
+    r"previous|earlier|before|last)\b",
+    re.IGNORECASE
+)
+
+# Anything the model starts after its Final Answer is a hallucinated next turn.
+NEXT_STEP = re.compile(r"\n\s*(Question|Thought|Action|Observation):")
+
+def format_table(payload):
+    """Render a read_data payload as a markdown table headed by its column names."""
+    if not payload or not payload["rows"]:
+        return "No data found."
+    columns = payload["columns"]
+    header = "| " + " | ".join(columns) + " |\n|" + "---|" * len(columns) + "\n"
+    table = header + "\n".join("| " + " | ".join(map(str, row)) + " |" for row in payload["rows"])
+    if payload.get("truncated"):
+        table += f"\n(showing first {len(payload['rows'])} rows; add a WHERE or LIMIT to narrow)"
+    return table
+
+def local_read_data(query: str):
+    """read_data against DB_PATH directly, for a server running on this host."""
+    return fetch(reader().execute(query), MAX_ROWS)
+
+async def add_data_wrapper(mcp_tools, query: str):
+    try:
+        return await mcp_tools["add_data"].ainvoke({"query": query.strip()})
+    except Exception as e:
+        return f"Add error: {str(e)}"
+
+async def add_rows_wrapper(mcp_tools, query: str):
+    try:
+        args = json.loads(query.strip())
+        return await mcp_tools["add_rows"].ainvoke({
+            "table": args["table"],
+            "columns": args["columns"],
+            "rows": args["rows"]
+        })
+    except Exception as e:
+        return f"Add error: {str(e)}"
+
+async def read_data_wrapper(mcp_tools, query: str, local_read=None):
+    try:
+        if local_read is not None:
+            result = await asyncio.to_thread(local_read, query.strip())
+        else:
+            result = await mcp_tools["read_data"].ainvoke({"query": query.strip()})
+        payload = json.loads(result) if isinstance(result, str) else result
+        return format_table(payload)
+    except Exception as e:
+        return f"Read error: {str(e)}"
+
+def split_statements(sql: str):
+    """Split ';'-separated SQL into statements, keeping ';' inside literals and triggers."""
+    statements, current = [], ""
+    for piece in sql.split(";"):
+        current += piece + ";"
+        if sqlite3.complete_statement(current):
+            if current.strip(" \t\r\n;"):
+                statements.append(current.strip().rstrip(";").strip())
+            current = ""
+    if current.strip(" \t\r\n;"):
+        statements.append(current.strip().rstrip(";").strip())
+    return statements
+
+async def batch_sql_wrapper(mcp_tools, query: str):
+    operations = split_statements(query)
+    try:
+        result = await mcp_tools["batch_sql"].ainvoke({"operations": operations})
+        payload = json.loads(result) if isinstance(result, str) else result
+        sections = []
+        for operation, outcome in zip(operations, payload["results"]):
+            if "error" in outcome:
+                body = f"Error: {outcome['error']}"
+            elif "rows" in outcome:
+                body = format_table(outcome)
+            else:
+                body = "OK"
+            sections.append(f"{operation}\n{body}")
+        return "\n\n".join(sections)
+    except Exception as e:
+        return f"Batch error: {str(e)}"
+
+def _use_async(query: str):
+    return "Use async"
+
+# Built once per process; initialize_agent binds each coroutine to its MCP tools.
+TOOLS = [
+    Tool(
+        name="add_data",
+        description="Add data using INSERT INTO ...",
+        func=_use_async,
+        coroutine=add_data_wrapper
+    ),
+    Tool(
+        name="add_rows",
+        description='Add several rows at once. Input is JSON, e.g. {"table": "people", '
+                    '"columns": ["name", "age", "profession"], "rows": [["Ann", 30, "Chef"], ["Bob", 41, "Pilot"]]}',
+        func=_use_async,
+        coroutine=add_rows_wrapper
+    ),
+    Tool(
+        name="read_data",
+        description="Read data using SELECT ...",
+        func=_use_async,
+        coroutine=read_data_wrapper
+    ),
+    Tool(
+        name="create_table",
+        description="Create a table using CREATE TABLE ...",
+        func=_use_async,
+        coroutine=add_data_wrapper
+    ),
+    Tool(
+        name="batch_sql",
+        description="Run several independent SQL statements at once, separated by semicolons",
+        func=_use_async,
+        coroutine=batch_sql_wrapper
+    )
+]
+
+# Parsed once per process, with the tool list already filled in.
+_PROMPT = ChatPromptTemplate.from_messages([
+    SystemMessage(content=SYSTEM_PROMPT),
+    HumanMessagePromptTemplate.from_template(REACT_TEMPLATE)
+]).partial(tools=render_text_description(TOOLS), tool_names=", ".join(tool.name for tool in TOOLS))
+
+class SemanticCache:
+    """Answers a question with a stored response when it embeds close to one seen before."""
+
+    def __init__(self, embeddings, threshold=0.92):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self._vectors = None
+        self._outputs = []
+
+    async def embed(self, text):
+        vector = np.asarray(await self.embeddings.aembed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def lookup(self, vector):
+        if not self._outputs:
+            return None
+        scores = self._vectors @ vector
+        best = int(scores.argmax())
+        return self._outputs[best] if scores[best] > self.threshold else None
+
+    def add(self, vector, output):
+        row = vector[np.newaxis, :]
+        self._vectors = row if self._vectors is None else np.vstack([self._vectors, row])
+        self._outputs.append(output)
+
+    def clear(self):
+        self._vectors = None
+        self._outputs = []
 
 class LangchainMCPClient:
-    def __init__(self, mcp_server_url="http://127.0.0.1:8000"):
-        self.llm = ChatOllama(model="llama3.2", temperature=0.6, streaming=False)
+    def __init__(self, mcp_server_url="http://127.0.0.1:8000", verbose=False,
+                 embedding_model="nomic-embed-text", cache_threshold=0.92):
+        self.verbose = verbose
+        self.llm = ChatOllama(
+            model="llama3.2",
+            temperature=0.6,
+            streaming=True,
+            keep_alive="30m",
+            num_ctx=8192
+        )
         server_config = {
             "default": {
                 "url": f"{mcp_server_url}/sse",
@@ -71,111 +288,174 @@ class LangchainMCPClient:
             }
         }
         self.mcp_client = MultiServerMCPClient(server_config)
+        self.embeddings = OllamaEmbeddings(model=embedding_model)
+        self.response_cache = SemanticCache(self.embeddings, threshold=cache_threshold)
+        self._example_vectors = None
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            timeout=httpx.Timeout(5.0)
+        )
         self.chat_history = []
-        self.SYSTEM_PROMPT = """You are an AI assistant that helps users interact with a database.
-You can add, read from, and create tables in the database using the available tools.
-Always think before acting. Ensure the SQL is correct.
-
-        When adding data:
-        1. Format the SQL query correctly
-        2. Make sure to use single quotes around text values
-        3. Don't use quotes around numeric values
-        
-        When reading data:
-        1. Use WHERE clause for filtering
-        2. Present results in a clear, formatted way
-        
-        Always:
-        1. Think through each step carefully
-        2. Verify actions were successful
-        3. Provide clear summaries of what was done"""
+        self._history_summary = None
+        # When the server runs on this host, reads can open its database
+        # read-only and skip the SSE round trip. Set MCP_DISABLE_LOCAL_READ to
+        # always go through MCP.
+        self._local_read = None
+        if (mcp_server_url.startswith(("http://127.0.0.1", "http://localhost"))
+                and not os.getenv("MCP_DISABLE_LOCAL_READ") and DB_PATH.exists()):
+            self._local_read = local_read_data
 
     async def check_server_connection(self):
         base_url = self.mcp_client.connections["default"]["url"].replace("/sse", "")
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                sse_url = f"{base_url}/sse"
-                response = await client.get(sse_url, timeout=5.0)
-                return response.status_code == 200
+            response = await self._http.get(f"{base_url}/sse")
+            return response.status_code == 200
         except httpx.ReadTimeout:
             return True
         except Exception:
             return False
 
+    async def aclose(self):
+        await self._http.aclose()
+
     async def initialize_agent(self):
         if not await self.check_server_connection():
             raise ConnectionError("MCP server not reachable")
 
-        mcp_tools = await self.mcp_client.get_tools()
-
-        async def add_data_wrapper(query: str):
-            try:
-                return await mcp_tools[0].ainvoke({"query": query.strip()})
-            except Exception as e:
-                return f"Add error: {str(e)}"
-
-        async def read_data_wrapper(query: str):
-            try:
-                result = await mcp_tools[1].ainvoke({"query": query.strip()})
-                if not result:
-                    return "No data found."
-                headers = result[0::4]
-                rows = [result[i:i+4] for i in range(0, len(result), 4)]
-                table = ["| " + " | ".join(map(str, row)) + " |" for row in rows]
-                return "\n".join(table)
-            except Exception as e:
-                return f"Read error: {str(e)}"
+        mcp_tools = {tool.name: tool for tool in await self.mcp_client.get_tools()}
 
+        # The shared TOOLS only differ per client in which MCP session they call.
+        extra = {"read_data": {"local_read": self._local_read}}
         self.tools = [
-            Tool(
-                name="add_data",
-                description="Add data using INSERT INTO ...",
-                func=lambda x: "Use async",
-                coroutine=add_data_wrapper
-            ),
-            Tool(
-                name="read_data",
-                description="Read data using SELECT ...",
-                func=lambda x: "Use async",
-                coroutine=read_data_wrapper
-            ),
-            Tool(
-                name="create_table",
-                description="Create a table using CREATE TABLE ...",
-                func=lambda x: "Use async",
-                coroutine=add_data_wrapper
-            )
+            tool.model_copy(update={"coroutine": partial(tool.coroutine, mcp_tools, **extra.get(tool.name, {}))})
+            for tool in TOOLS
         ]
 
-        prompt = ChatPromptTemplate.from_messages([
-            SystemMessage(content=self.SYSTEM_PROMPT),
-            HumanMessagePromptTemplate.from_template(REACT_TEMPLATE)
-        ]).partial(tool_names=", ".join(tool.name for tool in self.tools))
-
-        self.agent = create_react_agent(llm=self.llm, tools=self.tools, prompt=prompt)
+        # Same pipeline as create_react_agent, except the LLM is driven by
+        # _generate_step so it can hang up once the Final Answer is complete.
+        self.agent = (
+            RunnablePassthrough.assign(agent_scratchpad=lambda x: format_log_to_str(x["intermediate_steps"]))
+            | _PROMPT
+            | RunnableLambda(self._generate_step)
+            | ReActSingleInputOutputParser()
+        )
         self.agent_executor = AgentExecutor(
             agent=self.agent,
             tools=self.tools,
-            verbose=True,
+            verbose=self.verbose,
             handle_parsing_errors=True,
-            max_iterations=1,
+            max_iterations=5,
             early_stopping_method="force",
             return_intermediate_steps=True
         )
 
+    async def _generate_step(self, prompt, config):
+        text = ""
+        async with aclosing(self.llm.astream(prompt, config, stop=["\nObservation"])) as chunks:
+            async for chunk in chunks:
+                text += chunk.content
+                answer = text.find("Final Answer:")
+                cut = NEXT_STEP.search(text, answer) if answer != -1 else None
+                if cut:
+                    # Leaving the aclosing block closes the Ollama HTTP stream.
+                    return text[:cut.start()]
+        return text
+
+    async def _embed(self, text: str):
+        try:
+            return await self.response_cache.embed(text)
+        except Exception:
+            return None
+
+    async def _select_example(self, vector):
+        if vector is not None and self._example_vectors is None:
+            try:
+                questions = [example.split("\n", 1)[0] for example in EXAMPLES]
+                vectors = np.asarray(await self.embeddings.aembed_documents(questions), dtype=np.float32)
+                self._example_vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+            except Exception:
+                pass
+        if vector is None or self._example_vectors is None:
+            return "\n\n".join(EXAMPLES)
+        return EXAMPLES[int((self._example_vectors @ vector).argmax())]
+
+    async def _get_history(self):
+        # chat_history grows in Human/AI pairs and HISTORY_WINDOW is even, so
+        # folding everything but the last window never splits a pair.
+        if len(self.chat_history) > 2 * HISTORY_WINDOW:
+            older = self.chat_history[:-HISTORY_WINDOW]
+            if self._history_summary is not None:
+                older = [self._history_summary] + older
+            summary = await self.llm.ainvoke([
+                SystemMessage(content="Summarize this conversation between a user and a database "
+                                      "assistant in a few sentences. Keep table names, values and results."),
+                HumanMessage(content=get_buffer_string(older))
+            ])
+            self._history_summary = SystemMessage(content=f"Summary so far: {summary.content}")
+            del self.chat_history[:-HISTORY_WINDOW]
+        history = self.chat_history
+        if self._history_summary is not None:
+            history = [self._history_summary] + history
+        if not history:
+            return ""
+        return "Conversation so far:\n" + get_buffer_string(history) + "\n\n"
+
+    async def _run_agent(self, user_input: str, vector, history: str):
+        try:
+            response = await self.agent_executor.ainvoke({
+                "input": user_input,
+                "example": await self._select_example(vector),
+                "chat_history": history
+            })
+        finally:
+            if WRITE_INTENT.search(user_input):
+                # The database may have changed, so earlier read answers may be stale.
+                self.response_cache.clear()
+        if isinstance(response, dict) and "output" in response:
+            return response["output"]
+        return None
+
+    async def _answer(self, user_input: str, with_history: bool):
+        vector = await self._embed(user_input)
+        # Only standalone reads are cached: a follow-up that points back at
+        # the conversation can mean something different each time.
+        cacheable = (vector is not None
+                     and not WRITE_INTENT.search(user_input)
+                     and not REFERS_BACK.search(user_input))
+        output = self.response_cache.lookup(vector) if cacheable else None
+        if output is None:
+            history = await self._get_history() if with_history else ""
+            output = await self._run_agent(user_input, vector, history)
+            if output is not None and cacheable:
+                self.response_cache.add(vector, output)
+        return output
+
     async def process_message(self, user_input: str):
         try:
-            response = await self.agent_executor.ainvoke({"input": user_input, "chat_history": self.chat_history})
-            if isinstance(response, dict) and "output" in response:
-                self.chat_history.extend([
-                    HumanMessage(content=user_input),
-                    AIMessage(content=response["output"])
-                ])
-                return response["output"]
-            return "Agent could not determine a valid result."
+            output = await self._answer(user_input, with_history=True)
+            if output is None:
+                return "Agent could not determine a valid result."
+            self.chat_history.extend([
+                HumanMessage(content=user_input),
+                AIMessage(content=output)
+            ])
+            return output
         except Exception as e:
             return f"Processing error: {str(e)}"
 
+    async def _one(self, user_input: str, sem: asyncio.Semaphore):
+        async with sem:
+            try:
+                # Each batch item runs without history so tasks never share state.
+                output = await self._answer(user_input, with_history=False)
+                return output if output is not None else "Agent could not determine a valid result."
+            except Exception as e:
+                return f"Processing error: {str(e)}"
+
+    async def process_batch(self, inputs, concurrency=8):
+        sem = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*[self._one(user_input, sem) for user_input in inputs])
+
     async def interactive_chat(self):
         print("Interactive chat started. Type 'exit' to quit.")
         while True:
@@ -188,8 +468,11 @@ Always think before acting. Ensure the SQL is correct.
 
 async def main():
     client = LangchainMCPClient()
-    await client.initialize_agent()
-    await client.interactive_chat()
+    try:
+        await client.initialize_agent()
+        await client.interactive_chat()
+    finally:
+        await client.aclose()
 
 if __name__ == "__main__":
     asyncio.run(main())
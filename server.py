@@ -1,13 +1,46 @@
+import re
+import asyncio
+import logging
 import sqlite3
 import argparse
+import threading
+from contextlib import contextmanager
 from mcp.server.fastmcp import FastMCP
+from database import DB_PATH, MAX_ROWS, fetch, reader
 
 mcp = FastMCP('sqlite-demo')
+logger = logging.getLogger(__name__)
 
-def init_db():
-    conn = sqlite3.connect('demo.db')
-    cursor = conn.cursor()
-    cursor.execute('''
+# One connection for the whole process; FastMCP may dispatch tools from a
+# threadpool, so every use goes through _LOCK.
+_CONN = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+_LOCK = threading.Lock()
+
+# WAL lets readers run alongside a writer, and synchronous=NORMAL drops the
+# per-commit fsync that dominates INSERT latency.
+_CONN.executescript('''
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-20000;
+    PRAGMA mmap_size=268435456;
+''')
+
+@contextmanager
+def _transaction():
+    """Hold the connection lock and wrap the block in one write transaction."""
+    with _LOCK:
+        _CONN.execute('BEGIN IMMEDIATE')
+        try:
+            yield _CONN
+        except BaseException:
+            _CONN.execute('ROLLBACK')
+            raise
+        _CONN.execute('COMMIT')
+
+def _bootstrap():
+    """Create the default schema; runs once when the module is imported."""
+    _CONN.execute('''
         CREATE TABLE IF NOT EXISTS people (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
@@ -15,8 +48,90 @@ def init_db():
             profession TEXT NOT NULL
         )
     ''')
-    conn.commit()
-    return conn, cursor
+
+_bootstrap()
+
+def _get_cursor():
+    """Cursor on the shared connection; callers must hold _LOCK while using it."""
+    return _CONN.cursor()
+
+# Single-row INSERT ... (cols) VALUES (...) statements with plain literals
+# are rewritten into bound parameters; anything else runs as-is.
+_INSERT_RE = re.compile(
+    r"^\s*INSERT\s+INTO\s+[\"`]?(\w+)[\"`]?\s*\(([^)]*)\)\s*VALUES\s*\((.*)\)\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+_VALUE_RE = re.compile(
+    r"\s*(?:'((?:[^']|'')*)'|(-?\d+\.\d+)|(-?\d+)|(NULL))\s*",
+    re.IGNORECASE,
+)
+
+_READ_RE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+def _parse_insert(query):
+    """Split a literal single-row INSERT into (table, columns, row), or None.
+
+    Example:
+        >>> _parse_insert("INSERT INTO people (name, age) VALUES ('O''Brien', 30)")
+        ('people', ['name', 'age'], ["O'Brien", 30])
+        >>> _parse_insert("INSERT INTO people (name) VALUES ('x',)") is None
+        True
+        >>> _parse_insert("INSERT INTO people (name) VALUES (lower('x'))") is None
+        True
+    """
+    match = _INSERT_RE.match(query)
+    if match is None:
+        return None
+    table, columns, values = match.groups()
+    columns = [column.strip().strip('"`') for column in columns.split(',')]
+    if not all(re.fullmatch(r'\w+', column) for column in columns):
+        return None
+    row, pos = [], 0
+    while True:
+        value = _VALUE_RE.match(values, pos)
+        if value is None:
+            return None
+        text, real, integer, _ = value.groups()
+        if text is not None:
+            row.append(text.replace("''", "'"))
+        elif real is not None:
+            row.append(float(real))
+        elif integer is not None:
+            row.append(int(integer))
+        else:
+            row.append(None)
+        pos = value.end()
+        if pos == len(values):
+            break
+        # Values are comma-separated; a trailing comma leaves nothing to match.
+        if values[pos] != ',':
+            return None
+        pos += 1
+    if len(row) != len(columns):
+        return None
+    return table, columns, row
+
+def _insert_rows(table, columns, rows):
+    """Bind rows into one prepared INSERT after checking names against the schema."""
+    with _transaction() as conn:
+        found = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ? COLLATE NOCASE",
+            (table,),
+        ).fetchone()
+        if found is None:
+            raise ValueError(f"no such table: {table}")
+        known = {row[1].lower() for row in conn.execute(f"PRAGMA table_info({_quote(found[0])})")}
+        unknown = [column for column in columns if column.lower() not in known]
+        if unknown:
+            raise ValueError(f"no such column(s) in {found[0]}: {', '.join(unknown)}")
+        placeholders = ", ".join("?" for _ in columns)
+        conn.executemany(
+            f"INSERT INTO {_quote(found[0])} ({', '.join(map(_quote, columns))}) VALUES ({placeholders})",
+            rows,
+        )
 
 @mcp.tool()
 def add_data(query: str) -> bool:
@@ -52,20 +167,47 @@ def add_data(query: str) -> bool:
         >>> add_data(query)
         True
     """
-    conn, cursor = init_db()
     try:
-        print(f"\n\nExecuting add_data with query: {query}")
-        cursor.execute(query)
-        conn.commit()
+        logger.debug("Executing add_data query: %s", query)
+        parsed = _parse_insert(query)
+        if parsed is not None:
+            table, columns, row = parsed
+            _insert_rows(table, columns, [row])
+        else:
+            with _transaction() as conn:
+                conn.execute(query)
         return True
-    except sqlite3.Error as e:
-        print(f"Error adding data: {e}")
+    except (sqlite3.Error, ValueError) as e:
+        logger.warning("Error adding data: %s", e)
+        return False
+
+@mcp.tool()
+def add_rows(table: str, columns: list[str], rows: list[list]) -> bool:
+    """Add one or more rows to an existing table without writing SQL.
+
+    Args:
+        table (str): Name of an existing table, e.g. "people"
+        columns (list[str]): Columns to fill, e.g. ["name", "age", "profession"]
+        rows (list[list]): One list of values per row, in the same order as columns
+
+    Returns:
+        bool: True if every row was added, False otherwise (no rows are added on failure)
+
+    Example:
+        >>> add_rows("people", ["name", "age", "profession"],
+        ...          [["Alice Smith", 25, "Developer"], ["Bob Jones", 41, "Chef"]])
+        True
+    """
+    try:
+        logger.debug("Executing add_rows on %s with %d row(s)", table, len(rows))
+        _insert_rows(table, columns, rows)
+        return True
+    except (sqlite3.Error, ValueError) as e:
+        logger.warning("Error adding rows: %s", e)
         return False
-    finally:
-        conn.close()
 
 @mcp.tool()
-def read_data(query: str = "SELECT * FROM people") -> list:
+def read_data(query: str = "SELECT * FROM people", max_rows: int = MAX_ROWS) -> dict:
     """Read data from any table using a SQL SELECT query.
 
     Args:
@@ -74,38 +216,36 @@ def read_data(query: str = "SELECT * FROM people") -> list:
             - "SELECT * FROM people"
             - "SELECT name, age FROM people WHERE age > 25"
             - "SELECT * FROM people ORDER BY age DESC"
+        max_rows (int, optional): Stop reading after this many rows, clamped to
+            1..1000. Defaults to 1000.
     
     Returns:
-        list: List of tuples containing the query results.
-              For default query, tuple format for the default is (id, name, age, profession)
+        dict: {"columns": [...], "rows": [...], "truncated": bool} where columns
+              are the result column names, rows is a list of tuples in that
+              column order and truncated is True if more than max_rows matched.
+              For default query, columns are (id, name, age, profession)
     
     Example:
         >>> # Read all records
         >>> read_data()
-        [(1, 'John Doe', 30, 'Engineer'), (2, 'Alice Smith', 25, 'Developer')]
+        {'columns': ['id', 'name', 'age', 'profession'], 'rows': [(1, 'John Doe', 30, 'Engineer'), (2, 'Alice Smith', 25, 'Developer')], 'truncated': False}
         
         >>> # Read with custom query
         >>> read_data("SELECT name, profession FROM people WHERE age < 30")
-        [('Alice Smith', 'Developer')]
+        {'columns': ['name', 'profession'], 'rows': [('Alice Smith', 'Developer')], 'truncated': False}
     Example 2:
-        >>> # Read all records from new_table
-        >>> read_data()
-        [(1, 'John Doe', 30, 'Engineer'), (2, 'Alice Smith', 25, 'Developer')]
-        
-        >>> # Read with custom query
+        >>> # Read with custom query from new_table
         >>> read_data("SELECT column_1, column_2 FROM new_table WHERE column_1='smith")
-        [('Smith', 'extra')]
+        {'columns': ['column_1', 'column_2'], 'rows': [('Smith', 'extra')], 'truncated': False}
     """
-    conn, cursor = init_db()
     try:
-        print(f"\n\nExecuting read_data with query: {query}")
-        cursor.execute(query)
-        return cursor.fetchall()
+        logger.debug("Executing read_data query: %s", query)
+        # Read-only connection: writes smuggled in here fail instead of committing.
+        max_rows = max(1, min(max_rows, MAX_ROWS))
+        return fetch(reader().execute(query), max_rows)
     except sqlite3.Error as e:
-        print(f"Error reading data: {e}")
-        return []
-    finally:
-        conn.close()
+        logger.warning("Error reading data: %s", e)
+        return {"columns": [], "rows": [], "truncated": False}
         
 @mcp.tool()
 def create_table(query: str = "Create table New_table (ID int, new_column varchar(255))") -> list:
@@ -131,22 +271,66 @@ def create_table(query: str = "Create table New_table (ID int, new_column varcha
         >>> create_table("SELECT name, profession FROM new_table WHERE age < 30")
         [('Alice Smith', 'Developer')]
     """
-    conn, cursor = init_db()
     try:
-        print(f"\n\nExecuting read_data with query: {query}")
-        cursor.execute(query)
-        return cursor.fetchall()
+        logger.debug("Executing create_table query: %s", query)
+        with _LOCK:
+            _CONN.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = _get_cursor().execute(query)
+                rows = cursor.fetchall()
+            except BaseException:
+                _CONN.execute('ROLLBACK')
+                raise
+            # Keep schema changes only; row changes (rowcount != -1) are rolled
+            # back, as they were when this closed its connection uncommitted.
+            _CONN.execute('COMMIT' if cursor.rowcount == -1 else 'ROLLBACK')
+            return rows
     except sqlite3.Error as e:
-        print(f"Error reading data: {e}")
+        logger.warning("Error creating table: %s", e)
         return []
-    finally:
-        conn.close()
 
 
+def _run_operation(query):
+    try:
+        if _READ_RE.match(query):
+            return fetch(reader().execute(query), MAX_ROWS)
+        with _transaction() as conn:
+            conn.execute(query)
+        return {"ok": True}
+    except sqlite3.Error as e:
+        return {"error": str(e)}
+
+@mcp.tool()
+async def batch_sql(operations: list[str]) -> dict:
+    """Run several independent SQL statements concurrently in one call.
+
+    SELECT statements run in parallel on read-only connections; any other
+    statement is executed in its own transaction, one writer at a time.
+    The statements must not depend on each other's results.
+
+    Args:
+        operations (list[str]): SQL statements, e.g.
+            ["SELECT * FROM people", "SELECT * FROM car WHERE year < 2020"]
+
+    Returns:
+        dict: {"results": [...]} with one entry per operation, in order.
+              Reads give the read_data payload, writes give {"ok": True},
+              failures give {"error": "..."}.
+
+    Example:
+        >>> await batch_sql(["SELECT name FROM people",
+        ...                  "INSERT INTO car (make, year) VALUES ('Ford', 2021)"])
+        {'results': [{'columns': ['name'], 'rows': [('John Doe',)], 'truncated': False}, {'ok': True}]}
+    """
+    logger.debug("Executing batch_sql with %d operation(s)", len(operations))
+    results = await asyncio.gather(*(asyncio.to_thread(_run_operation, op) for op in operations))
+    return {"results": results}
+
 
 if __name__ == "__main__":
     # Start the server
-    print("🚀Starting server... ")
+    logging.basicConfig(level=logging.INFO)
+    logger.info("🚀Starting server... ")
 
     parser = argparse.ArgumentParser()
     parser.add_argument(